@@ -6,12 +6,16 @@
         python f101_csv.py export --to-date 2018-01-31 \
                                   --file /tmp/f101_201801.csv
 
+    Экспорт через pandas порциями (если нужны преобразования на лету):
+        python f101_csv.py export --to-date 2018-01-31 \
+                                  --file /tmp/f101_201801.csv --chunksize 50000
+
     Импорт (например, после ручного правления CSV):
         python f101_csv.py import --file /tmp/f101_201801.csv
 
 Параметры подключения читаются из .env:
     DB_HOST DB_PORT DB_NAME DB_USER DB_PASSWORD
-Нужен psycopg2-binary  и  pandas  (для экспорта).
+Нужен psycopg2-binary; для --chunksize ещё pandas и sqlalchemy.
 """
 
 import os
@@ -20,7 +24,6 @@ import argparse
 import datetime as dt
 from contextlib import closing
 
-import pandas as pd
 import psycopg2
 from psycopg2 import sql
 from dotenv import load_dotenv
@@ -77,26 +80,72 @@ def log_finish(cur, run_id: int, status: str,
 # ------------------------------------------------------------------#
 # 3. Экспорт витрины в CSV
 # ------------------------------------------------------------------#
-def export_f101(to_date: str, file_path: str) -> None:
+F101_QUERY = """
+    SELECT *
+    FROM   dm.dm_f101_round_f
+    WHERE  to_date = %s
+    ORDER  BY ledger_account, characteristic
+"""
+
+def export_chunks(to_date_dt: dt.date, file_path: str, chunksize: int) -> int:
+    """Выгрузить витрину через pandas порциями по chunksize строк."""
+    # pandas и sqlalchemy нужны только здесь — обычный export/import без них
+    import pandas as pd
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import URL
+
+    engine = create_engine(URL.create(
+        "postgresql+psycopg2",
+        username=DB_PARAMS["user"],
+        password=DB_PARAMS["password"],
+        host=DB_PARAMS["host"],
+        port=DB_PARAMS["port"],
+        database=DB_PARAMS["dbname"],
+    ))
+    total = 0
+    try:
+        # stream_results → server-side cursor: в памяти не больше одной порции
+        with engine.connect().execution_options(
+            stream_results=True, max_row_buffer=chunksize
+        ) as sa_conn:
+            chunks = pd.read_sql(F101_QUERY, sa_conn, params=(to_date_dt,), chunksize=chunksize)
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(file_path, mode="w" if i == 0 else "a", header=(i == 0),
+                             index=False, encoding="utf-8", quoting=csv.QUOTE_MINIMAL)
+                total += len(chunk)
+    finally:
+        engine.dispose()
+    return total
+
+
+def export_f101(to_date: str, file_path: str, chunksize: int | None = None) -> None:
     to_date_dt = dt.datetime.strptime(to_date, "%Y-%m-%d").date()
 
-    with closing(psycopg2.connect(**DB_PARAMS)) as conn, conn.cursor() as cur:
-        run_id = log_start(cur, EXPORT_TASK, note=file_path)
+    with closing(psycopg2.connect(**DB_PARAMS)) as conn:
+        # без commit запись лога терялась вместе с соединением
+        with conn, conn.cursor() as cur:
+            run_id = log_start(cur, EXPORT_TASK, note=file_path)
+
         try:
-            query = """
-                    SELECT *
-                    FROM   dm.dm_f101_round_f
-                    WHERE  to_date = %s
-                    ORDER  BY ledger_account, characteristic
-                    """
-            df = pd.read_sql(query, conn, params=(to_date_dt,))
-
-            df.to_csv(file_path, index=False, encoding="utf-8", quoting=csv.QUOTE_MINIMAL)
-
-            log_finish(cur, run_id, status="SUCCESS", rows=len(df))
-            print(f"Exported {len(df)} rows -> {file_path}")
+            with conn, conn.cursor() as cur:
+                if chunksize:
+                    rows = export_chunks(to_date_dt, file_path, chunksize)
+                else:
+                    # COPY TO STDOUT пишет строки прямо в файл, без DataFrame в памяти
+                    query = cur.mogrify(
+                        f"COPY ({F101_QUERY}) TO STDOUT WITH (FORMAT csv, HEADER, ENCODING 'UTF8')",
+                        (to_date_dt,),
+                    ).decode()
+                    with open(file_path, "wb") as f:
+                        cur.copy_expert(query, f)
+                    rows = cur.rowcount
+
+                log_finish(cur, run_id, status="SUCCESS", rows=rows)
+            print(f"Exported {rows} rows -> {file_path}")
         except Exception as exc:
-            log_finish(cur, run_id, status="FAILED", note=str(exc))
+            # после ошибки транзакция откатана — FAILED пишем в новой
+            with conn, conn.cursor() as cur:
+                log_finish(cur, run_id, status="FAILED", note=str(exc))
             raise
 
 
@@ -109,12 +158,23 @@ CREATE TABLE IF NOT EXISTS dm.dm_f101_round_f_v2
 (LIKE dm.dm_f101_round_f INCLUDING ALL);
 """
 
+# действуют только внутри транзакции загрузки
+BULK_SETTINGS_SQL = """
+SET LOCAL synchronous_commit = off;
+SET LOCAL work_mem = '256MB';
+SET LOCAL maintenance_work_mem = '1GB';
+"""
+
 def import_f101(file_path: str) -> None:
     with closing(psycopg2.connect(**DB_PARAMS)) as conn:
-        conn.autocommit = True                 # ← это решает проблему
-        with conn.cursor() as cur:
+        # STARTED фиксируем сразу — запись видна, пока идёт загрузка
+        with conn, conn.cursor() as cur:
             run_id = log_start(cur, IMPORT_TASK, note=file_path)
-            try:
+
+        try:
+            # TRUNCATE + COPY — одна транзакция: при ошибке копия витрины не пустеет
+            with conn, conn.cursor() as cur:
+                cur.execute(BULK_SETTINGS_SQL)
                 cur.execute(DDL_COPY_TABLE)
                 cur.execute("TRUNCATE dm.dm_f101_round_f_v2")
 
@@ -123,15 +183,15 @@ def import_f101(file_path: str) -> None:
                         "COPY dm.dm_f101_round_f_v2 FROM STDIN WITH CSV HEADER",
                         f,
                     )
-
-                cur.execute("SELECT COUNT(*) FROM dm.dm_f101_round_f_v2")
-                rows = cur.fetchone()[0]
+                # после TRUNCATE число скопированных строк = размер таблицы
+                rows = cur.rowcount
 
                 log_finish(cur, run_id, status="SUCCESS", rows=rows)
-                print(f"Imported {rows} rows <- {file_path}")
-            except Exception as exc: 
+            print(f"Imported {rows} rows <- {file_path}")
+        except Exception as exc:
+            with conn, conn.cursor() as cur:
                 log_finish(cur, run_id, status="FAILED", note=str(exc))
-                raise
+            raise
 
 
 # ------------------------------------------------------------------#
@@ -144,6 +204,7 @@ def main() -> None:
     p_exp = sub.add_parser("export", help="Выгрузить CSV")
     p_exp.add_argument("--to-date", required=True, help="to_date (YYYY-MM-DD)")
     p_exp.add_argument("--file",    required=True, help="куда писать CSV")
+    p_exp.add_argument("--chunksize", type=int, help="выгружать через pandas порциями")
 
     p_imp = sub.add_parser("import", help="Загрузить CSV")
     p_imp.add_argument("--file", required=True, help="откуда читать CSV")
@@ -151,7 +212,7 @@ def main() -> None:
     args = parser.parse_args()
 
     if args.cmd == "export":
-        export_f101(args.to_date, args.file)
+        export_f101(args.to_date, args.file, args.chunksize)
     else:
         import_f101(args.file)
 
@@ -1,24 +1,59 @@
-import csv
+"""
+Загрузка CSV из data/ в таблицы ds.* с логом в logs.etl_runs.
+
+    python main.py [каталог_с_csv]
+
+Переменные окружения (кроме параметров подключения DB_* из .env):
+    USE_COPY=0      — многострочный INSERT через execute_values вместо COPY
+    DEBUG_MEMORY=1  — печатать размер каждой подготовленной порции
+    DEMO_SLEEP=5    — пауза в секундах после записи 'running' в лог, чтобы
+                      на демонстрации было видно незавершённый запуск (по умолчанию 0)
+"""
+
+import codecs
+import itertools
 import os
-import math
+import re
+import tempfile
 import time
-from datetime import datetime
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import psycopg2
+import pyarrow as pa
+import pyarrow.csv as pac
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 
 # --------------------------------------------------------------------------- #
 # 1. Конфигурация                                                             #
 # --------------------------------------------------------------------------- #
 load_dotenv()
+
+# настройки сессии — один раз при подключении (libpq options), а не SET LOCAL
+# в каждой транзакции: соединения пула обслуживают только загрузку.
+# commit_delay сюда не входит — его может выставить только суперпользователь
+SESSION_SETTINGS = {
+    "synchronous_commit": "off",
+    "work_mem": "256MB",
+    "maintenance_work_mem": "1GB",
+    # staging-таблицы TEMP: WAL они не пишут, а живут в локальных буферах
+    # сессии (по умолчанию 8MB, дальше — диск); менять можно только до первого
+    # обращения к TEMP-таблице
+    "temp_buffers": "256MB",
+}
+
 conn_params = {
     "host": os.getenv("DB_HOST"),
     "database": os.getenv("DB_NAME"),
     "user": os.getenv("DB_USER"),
     "password": os.getenv("DB_PASSWORD"),
+    "options": " ".join(f"-c {name}={value}" for name, value in SESSION_SETTINGS.items()),
 }
 
 DATA_DIR = Path("/Users/ilya/Desktop/neoFlex/data")  # default CSV directory
@@ -37,39 +72,43 @@ csv_files = {
     "md_ledger_account_s": make_path("md_ledger_account_s"),
 }
 
+# потоки большую часть времени ждут сервер (COPY / INSERT) или парсер pyarrow,
+# оба отпускают GIL, — поэтому не привязано к числу ядер
+MAX_WORKERS = min(len(csv_files), 4)
+
 # --------------------------------------------------------------------------- #
 # 2. INSERT / UPSERT шаблоны                                                  #
 # --------------------------------------------------------------------------- #
 insert_queries = {
     "ft_balance_f": (
         "INSERT INTO ds.ft_balance_f (on_date, account_rk, currency_rk, balance_out) "
-        "VALUES (%s,%s,%s,%s) "
+        "VALUES %s "
         "ON CONFLICT (on_date, account_rk) DO UPDATE SET "
         "currency_rk = EXCLUDED.currency_rk, balance_out = EXCLUDED.balance_out;"
     ),
     "md_account_d": (
         "INSERT INTO ds.md_account_d (data_actual_date, data_actual_end_date, account_rk, "
-        "account_number, char_type, currency_rk, currency_code) VALUES (%s,%s,%s,%s,%s,%s,%s) "
+        "account_number, char_type, currency_rk, currency_code) VALUES %s "
         "ON CONFLICT (data_actual_date, account_rk) DO UPDATE SET "
         "data_actual_end_date = EXCLUDED.data_actual_end_date, account_number = EXCLUDED.account_number, "
         "char_type = EXCLUDED.char_type, currency_rk = EXCLUDED.currency_rk, currency_code = EXCLUDED.currency_code;"
     ),
     "md_currency_d": (
         "INSERT INTO ds.md_currency_d (currency_rk, data_actual_date, data_actual_end_date, currency_code, code_iso_char) "
-        "VALUES (%s,%s,%s,%s,%s) "
+        "VALUES %s "
         "ON CONFLICT (currency_rk, data_actual_date) DO UPDATE SET "
         "data_actual_end_date = EXCLUDED.data_actual_end_date, currency_code = EXCLUDED.currency_code, code_iso_char = EXCLUDED.code_iso_char;"
     ),
     "md_exchange_rate_d": (
         "INSERT INTO ds.md_exchange_rate_d (data_actual_date, data_actual_end_date, currency_rk, reduced_cource, code_iso_num) "
-        "VALUES (%s,%s,%s,%s,%s) "
+        "VALUES %s "
         "ON CONFLICT (data_actual_date, currency_rk) DO UPDATE SET "
         "data_actual_end_date = EXCLUDED.data_actual_end_date, reduced_cource = EXCLUDED.reduced_cource, code_iso_num = EXCLUDED.code_iso_num;"
     ),
     "md_ledger_account_s": (
         "INSERT INTO ds.md_ledger_account_s (chapter, chapter_name, section_number, section_name, subsection_name, "
         "ledger1_account, ledger1_account_name, ledger_account, ledger_account_name, characteristic, start_date, end_date) "
-        "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) "
+        "VALUES %s "
         "ON CONFLICT (ledger_account, start_date) DO UPDATE SET "
         "chapter = EXCLUDED.chapter, chapter_name = EXCLUDED.chapter_name, section_number = EXCLUDED.section_number, "
         "section_name = EXCLUDED.section_name, subsection_name = EXCLUDED.subsection_name, ledger1_account = EXCLUDED.ledger1_account, "
@@ -81,9 +120,46 @@ insert_queries = {
 # таблица без PK — полная перезаливка
 insert_queries["ft_posting_f"] = (
     "INSERT INTO ds.ft_posting_f (oper_date, credit_account_rk, debet_account_rk, credit_amount, debet_amount) "
-    "VALUES (%s,%s,%s,%s,%s);"
+    "VALUES %s;"
 )
 
+# первичные ключи upsert-таблиц: COPY в staging + merge_query
+pk_cols = {
+    "ft_balance_f": ("on_date", "account_rk"),
+    "md_account_d": ("data_actual_date", "account_rk"),
+    "md_currency_d": ("currency_rk", "data_actual_date"),
+    "md_exchange_rate_d": ("data_actual_date", "currency_rk"),
+    "md_ledger_account_s": ("ledger_account", "start_date"),
+}
+
+# таблицы без PK: очищаются перед загрузкой, COPY идёт прямо в таблицу.
+# Таблица ни там, ни там грузится через execute_values по insert_queries
+full_reload_tables = {"ft_posting_f"}
+
+# индексы, которые дешевле построить заново после COPY, чем обновлять на каждой
+# строке; DROP и CREATE идут в транзакции загрузки — откат вернёт индекс
+rebuild_indexes = {
+    "ft_posting_f": {
+        "ds.idx_ft_posting_f_oper_date": "CREATE INDEX idx_ft_posting_f_oper_date ON ds.ft_posting_f (oper_date)",
+    },
+}
+
+# колонки каждого INSERT разбираем один раз при импорте модуля
+TABLE_COLS = {
+    t: tuple(c.strip() for c in q.split("(", 1)[1].split(")", 1)[0].split(","))
+    for t, q in insert_queries.items()
+}
+TABLE_COLS_SQL = {t: ", ".join(cols) for t, cols in TABLE_COLS.items()}
+# для проверки заголовка файла: порядок колонок там не важен
+TABLE_COL_SETS = {t: frozenset(cols) for t, cols in TABLE_COLS.items()}
+
+# COPY вместо INSERT (USE_COPY=0 — многострочный INSERT через execute_values)
+USE_COPY = os.getenv("USE_COPY", "1") != "0"
+# COPY-буфер больше этого размера уходит из памяти во временный файл
+COPY_SPOOL_BYTES = 64 * 1024 * 1024
+# демонстрационная пауза после log_start; в обычном запуске не нужна
+DEMO_SLEEP = float(os.getenv("DEMO_SLEEP", "0"))
+
 # --------------------------------------------------------------------------- #
 # 3. Даты / VARCHAR лимиты                                                    #
 # --------------------------------------------------------------------------- #
@@ -93,71 +169,181 @@ date_columns = {
     "ft_posting_f": {"oper_date": "DD-MM-YYYY"},
 }
 
+# те же форматы в нотации strftime — для векторного pd.to_datetime
+date_formats = {
+    "DD.MM.YYYY": "%d.%m.%Y",
+    "DD-MM-YYYY": "%d-%m-%Y",
+    "YYYY-MM-DD": "%Y-%m-%d",
+}
+
 varchar_limits = {
     "md_currency_d": {"currency_code": 3, "code_iso_char": 3},
 }
 
+# остальные таблицы уже в нужном виде — файл уходит в COPY как есть, без pandas
+NEEDS_CLEANING = set(date_columns) | set(varchar_limits)
+
+# коды с несколькими различными значениями — category хранит каждое один раз
+category_columns = {"char_type", "currency_code", "code_iso_char", "characteristic"}
+
+# DEBUG_MEMORY=1 — печатать размер каждой подготовленной порции
+DEBUG_MEMORY = os.getenv("DEBUG_MEMORY", "0") == "1"
+
+# кодировки, в которых приходят выгрузки, — в порядке проверки;
+# latin-1 декодирует любые байты и замыкает список
+ENCODINGS = ("utf-8", "cp1251", "latin-1")
+# по BOM кодировка известна сразу, без пробного декодирования
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+# имена тех же кодировок для COPY ... ENCODING (UTF-16 PostgreSQL не читает)
+PG_ENCODINGS = {"utf-8": "UTF8", "utf-8-sig": "UTF8", "cp1251": "WIN1251", "latin-1": "LATIN1"}
+# кодировка определяется по началу файла такого размера
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+# файл читается порциями примерно такого размера — в памяти не весь CSV
+READ_BLOCK_BYTES = 16 * 1024 * 1024
+
 # --------------------------------------------------------------------------- #
 # 4. Утилиты                                                                  #
 # --------------------------------------------------------------------------- #
 
-def snake_case(s: str) -> str:
-    return s.strip().replace(" ", "_").replace("-", "_").lower()
+_SNAKE_RE = re.compile(r"[ -]")
 
 
-def convert_date(value: str, fmt: str) -> str | None:
-    if not value or str(value).lower() in {"nan", "none"}:
-        return None
-    try:
-        if fmt == "DD.MM.YYYY":
-            return datetime.strptime(value, "%d.%m.%Y").strftime("%Y-%m-%d")
-        if fmt == "DD-MM-YYYY":
-            return datetime.strptime(value, "%d-%m-%Y").strftime("%Y-%m-%d")
-        if fmt == "YYYY-MM-DD":
-            return value
-    except ValueError:
-        pass
-    return None
+# заголовки у всех порций и файлов одни и те же — каждый приводится один раз
+@lru_cache(maxsize=512)
+def snake_case(s: str) -> str:
+    return _SNAKE_RE.sub("_", s.strip()).lower()
 
 
-def pythonify(v):
-    if v is None: return None
-    if isinstance(v, float) and math.isnan(v): return None
-    if isinstance(v, np.generic): return v.item()
-    return v
+def to_db_rows(df: pd.DataFrame) -> Iterator[tuple]:
+    """Строки DataFrame кортежами нативных Python-значений, NA → None."""
+    # каждая колонка сразу превращается в Python-объекты с None вместо NA —
+    # без object-копии всего фрейма и маски пропусков по нему
+    columns = [df[c].to_numpy(dtype=object, na_value=None) for c in df.columns]
+    # кортежи psycopg2 адаптирует быстрее списков; execute_values сам режет
+    # итератор на страницы — весь список строк в памяти не собираем
+    return zip(*columns)
 
 # --------------------------------------------------------------------------- #
 # 5. DataFrame подготовка                                                     #
 # --------------------------------------------------------------------------- #
 
-def prepare_dataframe(table: str, path: Path) -> pd.DataFrame:
-    for enc in ("utf-8", "utf-8-sig", "cp1251", "latin-1"):
+def detect_encoding(path: Path) -> str:
+    """Кодировка по BOM или первая из ENCODINGS, в которой декодируется начало файла."""
+    with open(path, "rb") as f:
+        sample = f.read(ENCODING_SAMPLE_BYTES)
+    for bom, enc in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return enc
+    for enc in ENCODINGS:
         try:
-            df = pd.read_csv(path, delimiter=";", encoding=enc)
-            break
+            # final=False: многобайтовый символ на границе выборки не ошибка
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
         except UnicodeDecodeError:
             continue
-    else:
-        raise UnicodeDecodeError("Не удалось открыть файл", path, 0, 0, "кодировки")
-
-    df.columns = [snake_case(c) for c in df.columns]
-    dup_mask = df.duplicated(keep=False)
-    if dup_mask.any():
-        print(f"[WARN] {path.name}: {dup_mask.sum()} дубликат(ов) отброшено")
-        df = df[~dup_mask]
-
-    if table in date_columns:
-        for col, fmt in date_columns[table].items():
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: convert_date(str(x), fmt))
-        df = df.dropna(subset=date_columns[table].keys())
-
-    if table in varchar_limits:
-        for col, lim in varchar_limits[table].items():
-            if col in df.columns:
-                df[col] = df[col].astype(str).str.strip().str[:lim].replace({"": None})
-
-    return df
+        return enc
+    raise ValueError(f"{path.name}: не удалось подобрать кодировку")
+
+
+def read_csv_chunks(path: Path) -> Iterator[pd.DataFrame]:
+    """Читает CSV потоково парсером pyarrow; колонки — Arrow-backed строки.
+
+    Типы не выводятся: pyarrow определяет их по первой порции и падает на
+    следующей, если там встретится другое значение. Строки приводит сам PostgreSQL.
+    """
+    enc = detect_encoding(path)
+    with open(path, encoding=enc) as f:
+        header = f.readline().rstrip("\r\n").split(";")
+    reader = pac.open_csv(
+        path,
+        read_options=pac.ReadOptions(encoding=enc, block_size=READ_BLOCK_BYTES),
+        parse_options=pac.ParseOptions(delimiter=";"),
+        convert_options=pac.ConvertOptions(
+            column_types=dict.fromkeys(header, pa.string()),
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        yield pa.Table.from_batches([batch]).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def iter_prepared_chunks(table: str, path: Path) -> Iterator[pd.DataFrame]:
+    """Очищенные порции файла в порядке колонок INSERT; пустые порции пропускаются.
+
+    Дубликаты по ключу отбрасываются внутри порции, между порциями их
+    схлопывает merge_query; полные дубли таблиц без PK — по всему файлу.
+    """
+    # список, а не кортеж: df[tuple] pandas понимает как один ключ
+    cols_order = list(TABLE_COLS[table])
+    # дубликат — совпадение по первичному ключу (ft_posting_f: по всем колонкам);
+    # остаётся последняя строка, как и в merge_query
+    pk = list(pk_cols[table]) if table in pk_cols else None
+    rk_cols = [c for c in cols_order if c.endswith("_rk")]
+    cat_cols = [c for c in cols_order if c in category_columns]
+    # 64-битные хеши уже отправленных строк — для таблиц без PK, которые
+    # идут COPY прямо в целевую таблицу и merge_query не проходят
+    seen_rows: set[int] = set()
+    columns = None
+    dropped = 0
+
+    for df in read_csv_chunks(path):
+        # схема у всех порций файла одна — имена приводим и проверяем по первой
+        if columns is None:
+            columns = [snake_case(c) for c in df.columns]
+            if missing := sorted(TABLE_COL_SETS[table].difference(columns)):
+                raise ValueError(f"{path.name}: отсутствуют колонки {missing}")
+        df.columns = columns
+        # порядок столбцов должен соответствовать списку колонок в INSERT;
+        # лишние колонки файла дальше не обрабатываются
+        df = df[cols_order]
+
+        # *_rk — целые id: int32 вместо строк, ключи дедупликации хешируются как числа
+        for col in rk_cols:
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+
+        for col, fmt in date_columns.get(table, {}).items():
+            # различных дат в порции мало — разбираем каждую один раз и маппим
+            # (то же, что cache=True у pd.to_datetime, но strftime тоже по уникальным)
+            uniq = df[col].dropna().unique()
+            parsed = pd.to_datetime(uniq, format=date_formats[fmt], errors="coerce")
+            df[col] = df[col].map(dict(zip(uniq, parsed.strftime("%Y-%m-%d"))))
+        if table in date_columns:
+            df = df.dropna(subset=list(date_columns[table]))
+
+        for col, lim in varchar_limits.get(table, {}).items():
+            # колонка уже Arrow-строка — strip / slice сразу по её буферам, без astype
+            values = df[col].str.strip().str.slice(0, lim)
+            df[col] = values.mask(values == "", None)
+
+        # дубликаты ищем по уже нормализованным значениям — тем, что увидит БД
+        # (1.1.2018 и 01.01.2018 — одна дата)
+        before = len(df)
+        if pk is None:
+            hashes = pd.util.hash_pandas_object(df, index=False)
+            # проверка по самому set: isin копировал бы весь seen_rows в массив
+            # на каждой порции — время росло бы с размером уже загруженного
+            seen = np.fromiter(map(seen_rows.__contains__, hashes.tolist()), bool, len(hashes))
+            fresh = ~(hashes.duplicated().to_numpy() | seen)
+            seen_rows.update(hashes[fresh].tolist())
+            df = df[fresh].reset_index(drop=True)
+        else:
+            df = df.drop_duplicates(subset=pk, keep="last", ignore_index=True)
+        dropped += before - len(df)
+
+        for col in cat_cols:
+            df[col] = df[col].astype("category")
+
+        if not df.empty:
+            if DEBUG_MEMORY:
+                print(f"[MEM] {table}: {len(df)} строк, {df.memory_usage(deep=True).sum() / 1024:.0f} KB")
+            yield df
+
+    if dropped:
+        print(f"[WARN] {path.name}: {dropped} дубликат(ов) отброшено")
 
 # --------------------------------------------------------------------------- #
 # 6. Логирование                                                              #
@@ -165,7 +351,11 @@ def prepare_dataframe(table: str, path: Path) -> pd.DataFrame:
 
 def log_start(conn) -> int:
     with conn.cursor() as cur:
-        cur.execute(f"INSERT INTO {LOG_TABLE} (dag_id, task_id, status) VALUES (%s,%s,'running') RETURNING run_id", (DAG_ID, TASK_ID))
+        cur.execute(
+            f"INSERT INTO {LOG_TABLE} (dag_id, task_id, started_at, status) "
+            "VALUES (%s,%s,clock_timestamp(),'running') RETURNING run_id",
+            (DAG_ID, TASK_ID),
+        )
         run_id = cur.fetchone()[0]
     conn.commit()
     print(f"[LOG] run {run_id} started")
@@ -175,14 +365,72 @@ def log_start(conn) -> int:
 def log_finish(conn, run_id: int, status: str, rows: int, note: str | None = None):
     with conn.cursor() as cur:
         cur.execute(
-            f"UPDATE {LOG_TABLE} SET finished_at = now(), status = %s, rows_loaded = %s, note = %s WHERE run_id = %s",
+            f"UPDATE {LOG_TABLE} SET finished_at = clock_timestamp(), status = %s, rows_loaded = %s, note = %s WHERE run_id = %s",
             (status, rows, note, run_id),
         )
     conn.commit()
     print(f"[LOG] run {run_id} finished status={status} rows={rows}")
 
 # --------------------------------------------------------------------------- #
-# 7. Загрузка одной таблицы                                                   #
+# 7. COPY                                                                     #
+# --------------------------------------------------------------------------- #
+
+def copy_dataframe(cur, target: str, table: str, df: pd.DataFrame) -> None:
+    """Стримит DataFrame в target одним COPY FROM STDIN."""
+    # pandas сразу пишет UTF-8 байты — psycopg2 не перекодирует буфер построчно
+    with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_BYTES, mode="w+b") as buf:
+        df.to_csv(buf, sep="\t", header=False, index=False, na_rep="\\N", encoding="utf-8")
+        buf.seek(0)
+        cur.copy_expert(
+            f"COPY {target} ({TABLE_COLS_SQL[table]}) FROM STDIN "
+            "WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N', ENCODING 'UTF8')",
+            buf,
+        )
+
+
+def merge_query(table: str, stage: str) -> str:
+    """INSERT ... SELECT из staging с ON CONFLICT (pk) DO UPDATE по всем остальным колонкам.
+
+    На каждый ключ берётся одна строка — последняя в файле (ctid в свежем
+    staging идёт в порядке COPY), как было при построчном upsert.
+    """
+    pk = ", ".join(pk_cols[table])
+    col_list = TABLE_COLS_SQL[table]
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in TABLE_COLS[table] if c not in pk_cols[table])
+    return (
+        f"INSERT INTO ds.{table} ({col_list}) "
+        f"SELECT DISTINCT ON ({pk}) {col_list} FROM {stage} ORDER BY {pk}, ctid DESC "
+        f"ON CONFLICT ({pk}) DO UPDATE SET {updates}"
+    )
+
+
+def copy_csv_file(cur, table: str, path: Path) -> int | None:
+    """Грузит CSV без очистки напрямую через COPY; None — формат не подходит."""
+    enc = detect_encoding(path)
+    if enc not in PG_ENCODINGS:
+        return None
+    with open(path, "rb") as f:
+        header = [snake_case(c) for c in f.readline().decode(enc).rstrip("\r\n").split(";")]
+        if len(header) != len(TABLE_COLS[table]) or TABLE_COL_SETS[table].difference(header):
+            return None
+
+        stage = f"stg_{table}"
+        cur.execute(f"CREATE TEMP TABLE {stage} (LIKE ds.{table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        # заголовок уже прочитан — COPY начинает с первой строки данных
+        cur.copy_expert(
+            f"COPY {stage} ({', '.join(header)}) FROM STDIN "
+            f"WITH (FORMAT csv, DELIMITER ';', ENCODING '{PG_ENCODINGS[enc]}')",
+            f,
+        )
+    copied = cur.rowcount
+
+    cur.execute(merge_query(table, stage))
+    if dropped := copied - cur.rowcount:
+        print(f"[WARN] {path.name}: {dropped} дубликат(ов) отброшено")
+    return cur.rowcount
+
+# --------------------------------------------------------------------------- #
+# 8. Загрузка одной таблицы                                                   #
 # --------------------------------------------------------------------------- #
 
 def import_table(conn, table: str, path: Path) -> int:
@@ -191,48 +439,111 @@ def import_table(conn, table: str, path: Path) -> int:
         print(f"[SKIP] {path} отсутствует")
         return 0
 
-    df = prepare_dataframe(table, path)
-    if df.empty:
+    if USE_COPY and table in pk_cols and table not in NEEDS_CLEANING:
+        with conn.cursor() as cur:
+            loaded = copy_csv_file(cur, table, path)
+        if loaded is not None:
+            print(f"[OK] {table}: {loaded} строк загружено")
+            return loaded
+
+    chunks = iter_prepared_chunks(table, path)
+    if (first := next(chunks, None)) is None:
         print(f"[SKIP] {path.name}: после очистки строк не осталось")
         return 0
 
-    # порядок столбцов должен соответствовать VALUES(...)
-    cols_order = [snake_case(c.strip()) for c in insert_queries[table].split("(")[1].split(")")[0].split(",")]
-    if missing := [c for c in cols_order if c not in df.columns]:
-        raise ValueError(f"{path.name}: отсутствуют колонки {missing}")
+    loaded = 0
+    with conn.cursor() as cur:
+        if table in full_reload_tables:
+            cur.execute(f"TRUNCATE TABLE ds.{table}")
+        for index in rebuild_indexes.get(table, {}):
+            cur.execute(f"DROP INDEX IF EXISTS {index}")
+
+        # COPY в staging, затем один INSERT ... ON CONFLICT на всю таблицу
+        stage = f"stg_{table}" if USE_COPY and table in pk_cols else None
+        if stage:
+            cur.execute(f"CREATE TEMP TABLE {stage} (LIKE ds.{table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        copy_target = stage or (f"ds.{table}" if USE_COPY and table in full_reload_tables else None)
+
+        for df in itertools.chain([first], chunks):
+            if copy_target:
+                copy_dataframe(cur, copy_target, table, df)
+            else:
+                # один многострочный INSERT на 1000 строк — разбор и план раз на страницу;
+                # PREPARE + executemany (EXECUTE на каждую строку) вдвое медленнее
+                execute_values(cur, insert_queries[table], to_db_rows(df), page_size=1000)
+            loaded += len(df)
+
+        if stage:
+            cur.execute(merge_query(table, stage))
+            # ключи, повторяющиеся в разных порциях, схлопнулись только здесь
+            loaded = cur.rowcount
+        for create_sql in rebuild_indexes.get(table, {}).values():
+            cur.execute(create_sql)
+    print(f"[OK] {table}: {loaded} строк загружено")
+    return loaded
+
+
+_pool: ThreadedConnectionPool | None = None
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """Общий для потоков загрузки пул соединений; создаётся при первом обращении."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadedConnectionPool(minconn=1, maxconn=MAX_WORKERS + 1, **conn_params)
+    return _pool
+
+
+@contextmanager
+def pooled_connection():
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
 
-    df = df[cols_order].where(pd.notnull(df), None)
-    rows = [[pythonify(v) for v in r] for r in df.to_numpy()]
 
-    with conn.cursor() as cur:
-        if table == "ft_posting_f":
-            cur.execute("TRUNCATE TABLE ds.ft_posting_f")
-        cur.executemany(insert_queries[table], rows)
-    print(f"[OK] {table}: {len(rows)} строк загружено")
-    return len(rows)
+def load_table(table: str, path: Path) -> int:
+    """Загружает таблицу одной транзакцией на соединении из пула."""
+    with pooled_connection() as conn:
+        with conn:  # commit / rollback одной таблицы
+            return import_table(conn, table, path)
 
 # --------------------------------------------------------------------------- #
-# 8. main                                                                     #
+# 9. main                                                                     #
 # --------------------------------------------------------------------------- #
 if __name__ == "__main__":
     import sys
     root_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else DATA_DIR
 
-    conn = psycopg2.connect(**conn_params)
     try:
-        run_id = log_start(conn)
-        time.sleep(5)  # демонстрационная пауза
+        # лог — на отдельном соединении, вне транзакций загрузки
+        with pooled_connection() as conn:
+            run_id = log_start(conn)
+        if DEMO_SLEEP:
+            time.sleep(DEMO_SLEEP)
 
         total = 0
-        for tbl, default_path in csv_files.items():
-            path = root_dir / default_path.name if root_dir != DATA_DIR else default_path
+        # FK между таблицами ds.* нет — каждую грузим в своём потоке
+        # на своём соединении из пула
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = []
+            for tbl, default_path in csv_files.items():
+                path = root_dir / default_path.name if root_dir != DATA_DIR else default_path
+                futures.append(executor.submit(load_table, tbl, path))
             try:
-                total += import_table(conn, tbl, path)
+                for fut in as_completed(futures):
+                    total += fut.result()
             except Exception as e:
-                conn.rollback()
-                log_finish(conn, run_id, "failed", total, str(e))
+                executor.shutdown(cancel_futures=True)
+                with pooled_connection() as conn:
+                    log_finish(conn, run_id, "failed", total, str(e))
                 raise
 
-        log_finish(conn, run_id, "success", total)
+        with pooled_connection() as conn:
+            log_finish(conn, run_id, "success", total)
     finally:
-        conn.close()
+        # пул мог не создаться (нет связи с БД) — не открываем его ради закрытия
+        if _pool is not None:
+            _pool.closeall()
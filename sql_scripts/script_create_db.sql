@@ -15,6 +15,9 @@ CREATE TABLE IF NOT EXISTS ds.ft_posting_f
 , credit_amount     DOUBLE PRECISION
 , debet_amount      DOUBLE PRECISION
 );
+-- обороты за день (1.2) выбираются по oper_date;
+-- main.py удаляет индекс на время загрузки и строит заново
+CREATE INDEX IF NOT EXISTS idx_ft_posting_f_oper_date ON ds.ft_posting_f (oper_date);
 
 CREATE TABLE IF NOT EXISTS ds.md_account_d
 ( data_actual_date      DATE    NOT NULL